@@ -2,9 +2,18 @@ import streamlit as st
 import fitz  # pymupdf
 import openai
 import os
-from fpdf import FPDF
-from io import BytesIO
+import asyncio
+import hashlib
+import json
+import queue
 import re
+import threading
+import time
+import uuid
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from fpdf import FPDF
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 # ─── 1) Page Configuration ────────────────────────────────────────────────
 st.set_page_config(page_title="RAIN-CHECK")
@@ -12,198 +21,851 @@ st.set_page_config(page_title="RAIN-CHECK")
 # ─── 2) Initialize session state for current movie only ───────────────────
 if "current_movie" not in st.session_state:
     st.session_state["current_movie"] = None
+if "session_id" not in st.session_state:
+    # identifies this session as a watcher of shared batch jobs
+    st.session_state["session_id"] = uuid.uuid4().hex
+
+# Screenplays at least this long (in characters) are analysed through the
+# OpenAI Batch API; shorter ones use the interactive path.
+BATCH_MIN_CHARS = 120_000
+BATCH_POLL_SECONDS = 15
 
 # ─── 3) Set your OpenAI API key from Streamlit secrets ─────────────────────
 openai.api_key = st.secrets["OPENAI_API_KEY"]
 
 # ─── 4) Function to extract text from uploaded PDF ─────────────────────────
-def extract_text_from_pdf(pdf_file):
-    doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
-    text = ""
-    for page in doc:
-        text += page.get_text()
+_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT | fitz.TEXT_DEHYPHENATE
+
+def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    parts = [page.get_text("text", flags=_TEXT_FLAGS) for page in doc]
+    text = "".join(parts)
+    doc.close()  # release the MuPDF document now rather than at GC time
     return text
 
+# The leading underscore keeps Streamlit from hashing the PDF bytes: the
+# upload's SHA-256 is the cache key, so a repeat upload never reaches MuPDF
+@st.cache_data(persist="disk", show_spinner=False)
+def get_screenplay_text(file_sha: str, _pdf_bytes: bytes) -> str:
+    return extract_text_from_pdf(_pdf_bytes)
+
+def get_session_document(uploaded_file):
+    """
+    The current upload as a fitz.Document, opened from the uploader's bytes
+    on first use and kept in the session so later page-level work doesn't
+    re-parse the PDF.
+    """
+    if uploaded_file is None:
+        raise ValueError("No screenplay has been uploaded.")
+    doc = st.session_state.get("fitz_doc")
+    if doc is None:
+        doc = fitz.open(stream=uploaded_file.getvalue(), filetype="pdf")
+        st.session_state["fitz_doc"] = doc
+    return doc
+
+def close_session_document():
+    """
+    Closes the session's MuPDF document, if open.
+    """
+    doc = st.session_state.get("fitz_doc")
+    if doc is not None:
+        doc.close()
+    st.session_state["fitz_doc"] = None
+
+def get_text_range(uploaded_file, start: int, end: int) -> str:
+    """
+    Returns the text of pages start..end-1 of the current upload.
+    """
+    doc = get_session_document(uploaded_file)
+    pages = range(max(start, 0), min(end, doc.page_count))
+    return "".join(doc[i].get_text("text", flags=_TEXT_FLAGS) for i in pages)
+
 # ─── 5) Single‐call OpenAI helper ───────────────────────────────────────────
-def call_openai_single(prompt: str, model="gpt-4o-mini", temperature=0.7, max_tokens=1500):
+@st.cache_resource
+def get_openai_client():
+    """
+    One AsyncOpenAI client per process, so its connection pool (and the TLS
+    sessions in it) is reused across reruns and sessions.
+    """
+    return openai.AsyncOpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        max_retries=2,
+        timeout=60.0,
+        # Keeps the SDK's default timeouts and redirect handling, only widening the pool
+        http_client=openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+        ),
+    )
+
+@st.cache_resource
+def _get_event_loop():
+    """
+    A long-lived event loop on a daemon thread. The cached client's pooled
+    connections are bound to the loop they were opened on, so every OpenAI
+    coroutine runs here instead of in a fresh run_async() loop.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    """
+    Runs a coroutine on the shared event loop and blocks until it finishes.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_event_loop()).result()
+
+# Upper bound on in-flight requests, to stay within the account's RPM limit
+MAX_CONCURRENT_REQUESTS = 9
+
+# Set THREADED_SECTION_REQUESTS = true in the secrets to run the nine
+# non-streamed per-section requests on a thread pool with the synchronous
+# client. This only covers that path: the combined request, condensing, batch
+# jobs and streaming always use the async client.
+THREADED_SECTION_REQUESTS = st.secrets.get("THREADED_SECTION_REQUESTS", False)
+
+SYSTEM_PROMPT = (
+    "You are an AI chatbot automating script improvements and providing "
+    "data-driven insights (casting, budget, scheduling, marketing) to film producers."
+)
+
+def build_prefix_messages(screenplay_text: str) -> list:
+    """
+    The system prompt plus the screenplay, shared verbatim by every section
+    request. Keeping this prefix identical lets OpenAI's automatic prompt
+    caching reuse the screenplay tokens across the nine calls.
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f'Screenplay:\n"""{screenplay_text}"""'},
+    ]
+
+class ReportError(Exception):
     """
-    Calls OpenAI with a single prompt and returns the raw text response.
+    A request returned no usable report text (refusal or truncation).
     """
-    client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-    response = client.chat.completions.create(
+
+async def call_openai_single(instruction: str, prefix_messages: list, model="gpt-4o-mini",
+                             temperature=0.7, max_tokens=1500, on_delta=None):
+    """
+    Calls OpenAI with the shared prefix followed by a task-specific
+    instruction and returns the raw text response. If on_delta is given, the
+    response is streamed and on_delta is called with each piece of text as it
+    arrives. Raises ReportError if the response hit max_tokens, so cut-off text
+    is never shown or cached as if it were complete.
+    """
+    response = await get_openai_client().chat.completions.create(
+        model=model,
+        messages=prefix_messages + [{"role": "user", "content": instruction}],
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=on_delta is not None,
+    )
+    if on_delta is None:
+        choice = response.choices[0]
+        _check_finish_reason(choice.finish_reason, max_tokens)
+        return choice.message.content
+
+    parts, finish_reason = [], None
+    async for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+    _check_finish_reason(finish_reason, max_tokens)
+    return "".join(parts)
+
+def _check_finish_reason(finish_reason, max_tokens):
+    if finish_reason == "length":
+        raise ReportError(f"The response was cut off at its {max_tokens}-token limit.")
+
+@st.cache_resource
+def get_openai_sync_client():
+    """
+    Synchronous client for the thread-pool path. Its own retries are off;
+    call_openai_single_sync retries with backoff instead.
+    """
+    return openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"], max_retries=0, timeout=60.0)
+
+def _is_retryable(error: BaseException) -> bool:
+    """
+    The errors the OpenAI SDK itself retries: connection failures and
+    timeouts, 408, 409, 429 and 5xx responses.
+    """
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and (
+        error.status_code in (408, 409, 429) or error.status_code >= 500
+    )
+
+@retry(
+    retry=retry_if_exception(_is_retryable),
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, max=20),
+    reraise=True,
+)
+def call_openai_single_sync(instruction: str, prefix_messages: list, model="gpt-4o-mini",
+                            temperature=0.7, max_tokens=1500):
+    """
+    Blocking counterpart of call_openai_single, retried with backoff on the
+    same errors the SDK would retry.
+    """
+    response = get_openai_sync_client().chat.completions.create(
         model=model,
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are an AI chatbot automating script improvements and providing "
-                    "data-driven insights (casting, budget, scheduling, marketing) to film producers."
-                ),
-            },
-            {"role": "user", "content": prompt},
-        ],
+        messages=prefix_messages + [{"role": "user", "content": instruction}],
         temperature=temperature,
         max_tokens=max_tokens,
     )
-    return response.choices[0].message.content
+    choice = response.choices[0]
+    _check_finish_reason(choice.finish_reason, max_tokens)
+    return choice.message.content
 
 # ─── 6) Markdown‐cleaning helper ───────────────────────────────────────────
+_MD_STRIP = re.compile(r"(\*\*|__|`|#+\s*)")     # bold markers, backticks, headings
+_MD_NL = re.compile(r"\n{3,}")                    # excessive line breaks
+
 def clean_markdown(text):
-    text = re.sub(r"(\*\*|__)", "", text)         # remove bold markers
-    text = re.sub(r"(#+\s*)", "", text)            # remove headings
-    text = re.sub(r"`", "", text)                  # remove backticks
-    text = re.sub(r"\n{3,}", "\n\n", text)         # collapse excessive line breaks
+    text = _MD_STRIP.sub("", text)
+    text = _MD_NL.sub("\n\n", text)
     return text.strip()
 
 # ─── 7) PDF generation function ──────────────────────────────────────────
-def create_pdf_report(data: dict) -> BytesIO:
-    pdf = FPDF()
-    pdf.add_page()
-
-    font_regular = "DejaVuSans.ttf"
-    font_bold = "DejaVuSans-Bold.ttf"
+def get_report_fonts():
+    """
+    Locates the DejaVu TTFs. fpdf2 binds fonts to a single document, so each
+    report that needs them registers them with add_font().
+    """
+    font_regular = os.path.abspath("DejaVuSans.ttf")
+    font_bold = os.path.abspath("DejaVuSans-Bold.ttf")
 
     if not os.path.isfile(font_regular) or not os.path.isfile(font_bold):
         raise FileNotFoundError("Font files not found. Make sure DejaVu fonts are in the app folder.")
 
-    pdf.add_font("DejaVu", "", font_regular, uni=True)
-    pdf.add_font("DejaVu", "B", font_bold, uni=True)
+    return font_regular, font_bold
+
+def _fits_core_font(text: str) -> bool:
+    """
+    True if text can be drawn with fpdf2's built-in (latin-1) fonts.
+    """
+    try:
+        text.encode("latin-1")
+    except UnicodeEncodeError:
+        return False
+    return True
 
-    pdf.set_font("DejaVu", "B", 16)
-    pdf.cell(0, 10, "Screenplay Analysis Report", ln=True, align="C")
+def create_pdf_report(data: dict) -> bytes:
+    """
+    Renders the report PDF. `data` maps section names to text that has
+    already been through clean_markdown().
+    """
+    pdf = FPDF()
+    pdf.add_page()
+    dejavu_loaded = False
+
+    def set_font_for(text, style, size):
+        # Built-in Helvetica skips fpdf2's per-glyph TTF pipeline and isn't
+        # embedded; DejaVu is only loaded for text outside latin-1.
+        nonlocal dejavu_loaded
+        if _fits_core_font(text):
+            pdf.set_font("Helvetica", style, size)
+            return
+        if not dejavu_loaded:
+            font_regular, font_bold = get_report_fonts()
+            pdf.add_font("DejaVu", "", font_regular, uni=True)
+            pdf.add_font("DejaVu", "B", font_bold, uni=True)
+            dejavu_loaded = True
+        pdf.set_font("DejaVu", style, size)
+
+    title = "Screenplay Analysis Report"
+    set_font_for(title, "B", 16)
+    pdf.cell(0, 10, title, ln=True, align="C")
     pdf.ln(10)
 
     for section, content in data.items():
-        pdf.set_font("DejaVu", "B", 14)
+        set_font_for(section, "B", 14)
         pdf.cell(0, 10, section, ln=True)
         pdf.ln(2)
 
-        pdf.set_font("DejaVu", "", 12)
-        cleaned_content = clean_markdown(content)
-        pdf.multi_cell(0, 8, cleaned_content)
+        # One multi_cell per paragraph keeps each line-breaking pass short
+        set_font_for(content, "", 12)
+        for i, paragraph in enumerate(content.split("\n\n")):
+            if i:
+                pdf.ln(8)  # the blank line between paragraphs
+            pdf.multi_cell(0, 8, paragraph, markdown=False)
         pdf.ln(10)
 
-    buffer = BytesIO()
-    pdf.output(buffer)
-    buffer.seek(0)
-    return buffer
+    # bytes() copies fpdf2's bytearray once; writing into a BytesIO and letting
+    # st.download_button call getvalue() on it cost one copy more
+    return bytes(pdf.output())
 
 # ─── 8) Build prompts dictionary and query OpenAI per section ─────────────
-def get_all_analyses_single(screenplay_text: str) -> dict:
-    """
-    For each of the nine analysis sections, send a separate prompt to OpenAI
-    and collect the raw string response under the corresponding key.
-    """
-    prompts = {
-        "Logline": f"""Write a Hollywood-style logline for my screenplay. It should only contain the logline, making it engaging and high-concept.
-
-Screenplay:
-\"\"\"{screenplay_text}\"\"\"""",
-
-        "Genre": f"""Suggest the genre for the provided screenplay. By genre, we mean a particular type or style of literature, art, film, or music recognizable by its special characteristics.
-
-Screenplay:
-\"\"\"{screenplay_text}\"\"\"""",
-
-        "Top Keywords": f"""Give the top 10 keywords of the attached movie screenplay without any explanation.
+# Per-section instructions; the screenplay itself travels in the shared prefix
+INSTRUCTIONS = {
+    "Logline": """Write a Hollywood-style logline for my screenplay. It should only contain the logline, making it engaging and high-concept.""",
 
-Screenplay:
-\"\"\"{screenplay_text}\"\"\"""",
+    "Genre": """Suggest the genre for the provided screenplay. By genre, we mean a particular type or style of literature, art, film, or music recognizable by its special characteristics.""",
 
-        "Location Setting": f"""Give the location setting of the attached movie screenplay, considering only the primary location.
+    "Top Keywords": """Give the top 10 keywords of the attached movie screenplay without any explanation.""",
 
-Screenplay:
-\"\"\"{screenplay_text}\"\"\"""",
+    "Location Setting": """Give the location setting of the attached movie screenplay, considering only the primary location.""",
 
-        "Synopsis": f"""Give only the synopsis of the attached screenplay.
+    "Synopsis": """Give only the synopsis of the attached screenplay.""",
 
-Screenplay:
-\"\"\"{screenplay_text}\"\"\"""",
-
-        "Script Score": f"""Analyze the attached screenplay and give it a script score out of 10, including:
+    "Script Score": """Analyze the attached screenplay and give it a script score out of 10, including:
 - Character development score (out of 10) with 1-2 lines explanation
 - Plot construction (out of 10) with 1-2 lines explanation
 - Dialogue (out of 10) with 1-2 lines explanation
 - Originality (out of 10) with 1-2 lines explanation
 - Emotional engagement (out of 10) with 1-2 lines explanation
 - Theme and message (out of 10) with 1-2 lines explanation
-- Overall rating out of 10 with explanation
-
-Screenplay:
-\"\"\"{screenplay_text}\"\"\"""",
+- Overall rating out of 10 with explanation""",
 
-        "Plot Assessment": f"""Analyze the attached screenplay and give the plot assessment and enhancement, including:
+    "Plot Assessment": """Analyze the attached screenplay and give the plot assessment and enhancement, including:
 - 5 points of what is working well (positive aspects)
 - 5 points where the screenplay lacks
 - 5 points of improvements that may be made
-- An overall review of the screenplay
+- An overall review of the screenplay""",
 
-Screenplay:
-\"\"\"{screenplay_text}\"\"\"""",
-
-        "Character Profiling": f"""Analyze the attached screenplay and return character profiling for the main characters, including:
+    "Character Profiling": """Analyze the attached screenplay and return character profiling for the main characters, including:
 - Brief description of each main character
 - What is working well for each character
 - Areas for improvement
-- The archetype for each
-
-Screenplay:
-\"\"\"{screenplay_text}\"\"\"""",
+- The archetype for each""",
 
-        "Box Office Collection": f"""Analyze the attached screenplay and give its box office prediction with the following fields:
+    "Box Office Collection": """Analyze the attached screenplay and give its box office prediction with the following fields:
 - Opening day (global and local)
 - Opening week (global and local)
-- Opening month (global and local)
+- Opening month (global and local)""",
+}
+
+# Output caps per section, sized to what each section needs. Generation time
+# grows with output length, so short sections finish (and cost) less.
+MAX_TOKENS = {
+    "Logline": 100,
+    "Genre": 50,
+    "Top Keywords": 150,
+    "Location Setting": 100,
+    "Synopsis": 500,
+    "Script Score": 800,
+    "Plot Assessment": 900,
+    "Character Profiling": 900,
+    "Box Office Collection": 500,
+}
+
+# Model per section: the short classification-style sections go to a smaller,
+# faster model; scoring, assessment and profiling stay on gpt-4o-mini.
+MODEL_MAP = {
+    "Logline": "gpt-4o-mini",
+    "Genre": "gpt-4.1-nano",
+    "Top Keywords": "gpt-4.1-nano",
+    "Location Setting": "gpt-4.1-nano",
+    "Synopsis": "gpt-4o-mini",
+    "Script Score": "gpt-4o-mini",
+    "Plot Assessment": "gpt-4o-mini",
+    "Character Profiling": "gpt-4o-mini",
+    "Box Office Collection": "gpt-4o-mini",
+}
+
+def screenplay_digest(screenplay_text: str) -> str:
+    """
+    Short content hash identifying a screenplay independently of its file name.
+    """
+    return hashlib.sha256(screenplay_text.encode("utf-8")).hexdigest()[:16]
 
-Screenplay:
-\"\"\"{screenplay_text}\"\"\"""",
+# Keyed on the screenplay text, so re-uploading the same script (in any
+# session, and across restarts via the disk cache) skips the OpenAI calls
+@st.cache_data(show_spinner=False, max_entries=32, persist="disk")
+def get_all_analyses_single(screenplay_text: str, _updates=None) -> dict:
+    """
+    For each of the nine analysis sections, send a separate prompt to OpenAI
+    (all nine concurrently) and collect the raw string response under the
+    corresponding key. With an `_updates` queue (not part of the cache key),
+    responses are streamed and each (section, delta) pair is put on it; a
+    cache hit returns without putting anything. A section cut off at its
+    token limit raises ReportError, so the truncated report is not cached.
+    """
+    prefix_messages = build_prefix_messages(screenplay_text)
+    if _updates is not None or not THREADED_SECTION_REQUESTS:
+        responses = run_async(_gather_analyses(prefix_messages, INSTRUCTIONS, _updates))
+    else:
+        responses = _map_analyses_threaded(prefix_messages, INSTRUCTIONS)
+    return dict(zip(INSTRUCTIONS.keys(), responses))
+
+def _map_analyses_threaded(prefix_messages: list, instructions: dict) -> list:
+    """
+    Thread-pool fallback for _gather_analyses. The requests are I/O-bound, so
+    the threads overlap while waiting on the network.
+    """
+    def call(section, instruction):
+        try:
+            return call_openai_single_sync(
+                instruction, prefix_messages, model=MODEL_MAP[section], temperature=0.7,
+                max_tokens=MAX_TOKENS[section]
+            )
+        except ReportError as error:
+            raise ReportError(f"{section}: {error}") from error
+
+    with ThreadPoolExecutor(max_workers=min(len(instructions), MAX_CONCURRENT_REQUESTS)) as executor:
+        return list(executor.map(call, instructions.keys(), instructions.values()))
+
+def stream_all_analyses(screenplay_text: str, placeholders: dict) -> dict:
+    """
+    Runs get_all_analyses_single, streaming every section into
+    placeholders[section] while the nine responses are being generated.
+    """
+    # Streamlit cannot replay writes to placeholders made inside a cached
+    # function, so the cached call only fills a queue. It runs on a worker
+    # thread while this script thread moves the deltas into the placeholders.
+    updates = queue.Queue()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(get_all_analyses_single, screenplay_text, updates)
+
+        buffers = {section: [] for section in INSTRUCTIONS}
+        while not (future.done() and updates.empty()):
+            try:
+                pending = [updates.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            while not updates.empty():
+                pending.append(updates.get_nowait())
+
+            changed = set()
+            for section, delta in pending:
+                buffers[section].append(delta)
+                changed.add(section)
+            for section in changed:
+                placeholders[section].markdown("".join(buffers[section]))
+
+        return future.result()
+
+async def _gather_analyses(prefix_messages: list, instructions: dict, updates=None) -> list:
+    """
+    Runs all section instructions concurrently, at most MAX_CONCURRENT_REQUESTS
+    at a time. With an `updates` queue, responses are streamed and each text
+    delta is put on it as a (section, delta) pair.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def bounded_call(section, instruction):
+        on_delta = None
+        if updates is not None:
+            on_delta = lambda delta: updates.put((section, delta))
+        async with semaphore:
+            try:
+                return await call_openai_single(
+                    instruction, prefix_messages, model=MODEL_MAP[section], temperature=0.7,
+                    max_tokens=MAX_TOKENS[section], on_delta=on_delta,
+                )
+            except ReportError as error:
+                raise ReportError(f"{section}: {error}") from error
+
+    return await asyncio.gather(*(bounded_call(s, i) for s, i in instructions.items()))
+
+# JSON field for each section in the single structured-output request
+REPORT_FIELDS = {
+    "Logline": "logline",
+    "Genre": "genre",
+    "Top Keywords": "keywords",
+    "Location Setting": "location",
+    "Synopsis": "synopsis",
+    "Script Score": "script_score",
+    "Plot Assessment": "plot_assessment",
+    "Character Profiling": "character_profiling",
+    "Box Office Collection": "box_office",
+}
+
+REPORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        field: {"type": "string", "description": INSTRUCTIONS[section]}
+        for section, field in REPORT_FIELDS.items()
+    },
+    "required": list(REPORT_FIELDS.values()),
+    "additionalProperties": False,
+}
+
+REPORT_INSTRUCTION = (
+    "Produce the full screenplay analysis report. Fill in every field of the "
+    "response as its description asks, writing each one as plain text."
+)
+
+@st.cache_data(show_spinner=False, max_entries=32, persist="disk")
+def get_all_analyses_structured(screenplay_text: str) -> dict:
+    """
+    Asks for all nine sections in one structured-output request and maps the
+    returned JSON fields back to section names.
+    """
+    response = run_async(get_openai_client().chat.completions.create(
+        model="gpt-4o-mini",
+        messages=build_prefix_messages(screenplay_text)
+        + [{"role": "user", "content": REPORT_INSTRUCTION}],
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "screenplay_report", "schema": REPORT_SCHEMA, "strict": True},
+        },
+        temperature=0.7,
+        max_tokens=8000,
+    ))
+    choice = response.choices[0]
+    if choice.message.refusal:
+        raise ReportError(f"The model declined to analyse this screenplay: {choice.message.refusal}")
+    if choice.finish_reason == "length":
+        raise ReportError("The combined report was cut off before it was complete. "
+                          "Try the per-section analysis mode instead.")
+    report = json.loads(choice.message.content)
+    return {section: report[field] for section, field in REPORT_FIELDS.items()}
+
+# ─── 9) Batch API helpers for long screenplays ─────────────────────────────
+def _batch_request_body(instruction: str, prefix_messages: list, model="gpt-4o-mini",
+                        temperature=0.7, max_tokens=1200) -> dict:
+    """
+    Builds the /v1/chat/completions request body used for each batch line.
+    """
+    return {
+        "model": model,
+        "messages": prefix_messages + [{"role": "user", "content": instruction}],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
     }
 
-    results = {}
-    for section_name, prompt_text in prompts.items():
-        ai_response = call_openai_single(
-            prompt_text, model="gpt-4o-mini", temperature=0.7, max_tokens=1200
-        )
-        results[section_name] = ai_response
+async def _submit_batch(prefix_messages: list, instructions: dict) -> str:
+    client = get_openai_client()
+    # A batch input file may only target one model, so MODEL_MAP isn't applied here
+    lines = [
+        json.dumps({
+            "custom_id": section_name,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _batch_request_body(
+                instruction, prefix_messages, max_tokens=MAX_TOKENS[section_name]
+            ),
+        })
+        for section_name, instruction in instructions.items()
+    ]
+    batch_file = await client.files.create(
+        file=("screenplay_batch.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch",
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    return batch.id
+
+def submit_batch(prefix_messages: list, instructions: dict) -> str:
+    """
+    Uploads one request per section instruction as a JSONL batch file and
+    starts an OpenAI batch job over them. Returns the batch id to poll with
+    check_batch().
+    """
+    return run_async(_submit_batch(prefix_messages, instructions))
 
-    return results
+@st.cache_resource
+def get_batch_store():
+    """
+    Process-wide batch bookkeeping keyed by screenplay sha, so every session
+    analysing the same screenplay shares one batch job and its results.
+    "pending" maps a sha to {"batch_id", "sessions"}, where "sessions" holds
+    the ids of the sessions waiting on that job; "reports" holds completed,
+    fully successful batch results.
+    """
+    return {"lock": threading.Lock(), "pending": {}, "reports": {}}
+
+def cancel_batch(batch_id: str):
+    try:
+        run_async(get_openai_client().batches.cancel(batch_id))
+    except openai.APIStatusError:
+        pass  # the job finished (or failed) before it could be cancelled
+
+def release_batch(screenplay_sha: str, session_id: str):
+    """
+    Stops this session waiting on the screenplay's pending batch job and
+    cancels the job once no session is left waiting on it.
+    """
+    store = get_batch_store()
+    with store["lock"]:
+        pending = store["pending"].get(screenplay_sha)
+        if pending is None:
+            return
+        pending["sessions"].discard(session_id)
+        if pending["sessions"]:
+            return
+        del store["pending"][screenplay_sha]
+    cancel_batch(pending["batch_id"])
+
+def _batch_records(file_text: str) -> list:
+    return [json.loads(line) for line in file_text.splitlines() if line.strip()]
+
+async def _check_batch(batch_id: str, sections: list):
+    client = get_openai_client()
+    batch = await client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return batch.status, None, None
+
+    # Successful lines land in the output file and failed ones in the error
+    # file; either file is absent when it would be empty.
+    records = []
+    if batch.output_file_id:
+        records += _batch_records((await client.files.content(batch.output_file_id)).text)
+    if batch.error_file_id:
+        records += _batch_records((await client.files.content(batch.error_file_id)).text)
+
+    responses, errors = {}, {}
+    for record in records:
+        response = record.get("response") or {}
+        if response.get("status_code") == 200:
+            choice = response["body"]["choices"][0]
+            if choice.get("finish_reason") == "length":
+                errors[record["custom_id"]] = "response was cut off at its token limit"
+            else:
+                responses[record["custom_id"]] = choice["message"]["content"]
+        else:
+            error = record.get("error") or (response.get("body") or {}).get("error") or {}
+            errors[record["custom_id"]] = error.get("message", "request failed")
+
+    # Batch output lines are not guaranteed to come back in submission order
+    results = {name: responses[name] for name in sections if name in responses}
+    failed = {name: errors.get(name, "no response") for name in sections if name not in responses}
+    return batch.status, results, failed
+
+def check_batch(batch_id: str, sections: list):
+    """
+    Returns (status, results, failed). Once the batch has completed, results
+    maps each section in `sections` that succeeded to its text and failed maps
+    the rest to an error message; before that, both are None.
+    """
+    return run_async(_check_batch(batch_id, sections))
+
+# ─── 10) Condense long screenplays before analysis ────────────────────────
+# Screenplays at least this long, but below BATCH_MIN_CHARS, are summarised
+# chunk by chunk (map) and the summaries joined (reduce); the interactive
+# analysis prompts then read that condensed text plus the opening of the raw
+# script instead of the whole screenplay. Batch-path scripts are not condensed.
+COMPRESS_MIN_CHARS = 60_000
+COMPRESS_CHUNK_CHARS = 20_000
+RAW_EXCERPT_CHARS = 4_000
+
+CHUNK_SUMMARY_INSTRUCTION = (
+    "Summarize this part of the screenplay, preserving character names, "
+    "story beats and the tone of the dialogue."
+)
+
+# Optional scene number, then INT./EXT. in their usual spellings (INT, INT.,
+# INTERIOR, INT./EXT., INT/EXT, I/E)
+_SCENE_HEADING = re.compile(
+    r"^[ \t]*(?:\d+[A-Z]?[ \t]+)?(?:INT\.?/EXT\b|I/E\b|INT(?:ERIOR)?\b|EXT(?:ERIOR)?\b)", re.MULTILINE
+)
+# Fallback split points for oversized scenes, coarsest first
+_PARAGRAPH_BREAK = re.compile(r"(?<=\n\n)")
+_LINE_BREAK = re.compile(r"(?<=\n)")
+
+def _bounded_pieces(text: str, max_chars: int) -> list:
+    """
+    Cuts text longer than max_chars at blank lines, then at line breaks, and
+    only as a last resort every max_chars characters.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    for boundary in (_PARAGRAPH_BREAK, _LINE_BREAK):
+        parts = [part for part in boundary.split(text) if part]
+        if len(parts) > 1:
+            return [piece for part in parts for piece in _bounded_pieces(part, max_chars)]
+    return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+def split_into_scene_chunks(screenplay_text: str, max_chars=COMPRESS_CHUNK_CHARS) -> list:
+    """
+    Splits the screenplay at scene headings and packs consecutive scenes into
+    chunks of at most max_chars. Scenes longer than that (or a script whose
+    headings aren't recognised) are cut at paragraph or line breaks first.
+    """
+    starts = [match.start() for match in _SCENE_HEADING.finditer(screenplay_text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    scenes = [screenplay_text[a:b] for a, b in zip(starts, starts[1:] + [len(screenplay_text)])]
+
+    chunks, current, size = [], [], 0
+    for scene in scenes:
+        for piece in _bounded_pieces(scene, max_chars):
+            if current and size + len(piece) > max_chars:
+                chunks.append("".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+async def compress_screenplay(screenplay_text: str) -> str:
+    """
+    Summarises every chunk concurrently and joins the summaries in script order.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def summarize(chunk):
+        async with semaphore:
+            try:
+                return await call_openai_single(
+                    CHUNK_SUMMARY_INSTRUCTION, build_prefix_messages(chunk),
+                    model="gpt-4o-mini", temperature=0.3, max_tokens=800
+                )
+            except ReportError as error:
+                raise ReportError(f"Condensing the screenplay: {error}") from error
+
+    summaries = await asyncio.gather(*(summarize(c) for c in split_into_scene_chunks(screenplay_text)))
+    return "\n\n".join(summaries)
+
+@st.cache_data(show_spinner=False, max_entries=32, persist="disk")
+def get_condensed_screenplay(screenplay_sha: str, _screenplay_text: str) -> str:
+    """
+    Condensed stand-in for a long screenplay, cached by the screenplay's hash.
+    """
+    summary = run_async(compress_screenplay(_screenplay_text))
+    return (
+        f"Condensed summary of the full screenplay:\n{summary}\n\n"
+        f"Opening of the original screenplay:\n{_screenplay_text[:RAW_EXCERPT_CHARS]}"
+    )
 
-# ─── 9) Main Streamlit UI ─────────────────────────────────────────────────
+# ─── 11) Main Streamlit UI ─────────────────────────────────────────────────
 st.title("RAIN-CHECK")
 
+COMBINED_MODE = "Combined (one request)"
+PER_SECTION_MODE = "Per section (nine requests)"
+analysis_mode = st.sidebar.radio(
+    "Analysis mode",
+    [COMBINED_MODE, PER_SECTION_MODE],
+    help="Long screenplays are always analysed per section through the Batch API.",
+)
+stream_sections = not THREADED_SECTION_REQUESTS and analysis_mode == PER_SECTION_MODE and st.sidebar.checkbox(
+    "Stream sections as they are written", value=True
+)
+
 uploaded_file = st.file_uploader("Upload a movie screenplay (PDF)", type=["pdf"])
 if uploaded_file is not None:
     movie_name = os.path.splitext(uploaded_file.name)[0]
 
-    # Extract text on first upload or when movie changes
-    if "screenplay_text" not in st.session_state or st.session_state["current_movie"] != movie_name:
+    pdf_bytes = uploaded_file.getvalue()
+    file_sha = hashlib.sha256(pdf_bytes).hexdigest()
+    session_id = st.session_state["session_id"]
+    batch_store = get_batch_store()
+
+    # Extract text on first upload or when the uploaded file changes
+    if "screenplay_text" not in st.session_state or st.session_state.get("file_sha") != file_sha:
         with st.spinner("Extracting screenplay..."):
-            st.session_state["screenplay_text"] = extract_text_from_pdf(uploaded_file)
+            st.session_state["screenplay_text"] = get_screenplay_text(file_sha, pdf_bytes)
+        st.session_state["file_sha"] = file_sha
+
+        # Drop the previous upload's MuPDF document; the new one opens lazily
+        close_session_document()
+        screenplay_sha = screenplay_digest(st.session_state["screenplay_text"])
+        if st.session_state.get("screenplay_sha", screenplay_sha) != screenplay_sha:
+            # Stop waiting on (and cancel, if no other session is) the old screenplay's batch job
+            release_batch(st.session_state["screenplay_sha"], session_id)
+        st.session_state["screenplay_sha"] = screenplay_sha
         st.session_state["current_movie"] = movie_name
         st.success("Screenplay extracted and ready!")
 
+    all_results = None
     if st.button("Generate Report"):
-        with st.spinner("Analyzing screenplay…"):
-            all_results = get_all_analyses_single(st.session_state["screenplay_text"])
-
-        if all_results:
-            # Display each section in bold, then the raw text
-            st.write("**Analysis Results**")
-            st.write("")  # add a blank line
-
-            for section, content in all_results.items():
-                st.write(f"**{section}:**")
-                st.write(clean_markdown(content))
-                st.write("")  # blank line between sections
-
-            # PDF download button
-            pdf_file = create_pdf_report(all_results)
-            st.success("Analysis complete!")
-            st.download_button(
-                label="Download Analysis Report as PDF",
-                data=pdf_file,
-                file_name=f"{movie_name}-report.pdf",
-                mime="application/pdf"
-            )
+        screenplay_text = st.session_state["screenplay_text"]
+        screenplay_sha = st.session_state["screenplay_sha"]
+        pending = batch_store["pending"].get(screenplay_sha)
+        if screenplay_sha in batch_store["reports"]:
+            all_results = batch_store["reports"][screenplay_sha]
+        elif pending is not None:
+            # Join the job already running for this screenplay instead of paying for another
+            with batch_store["lock"]:
+                pending["sessions"].add(session_id)
+            st.info("A batch analysis for this screenplay is already in progress.")
+        else:
+            # The batch decision comes first: batch requests are already
+            # half price, so they get the full script, and condensing only
+            # serves the interactive range COMPRESS_MIN_CHARS..BATCH_MIN_CHARS
+            if len(screenplay_text) >= BATCH_MIN_CHARS:
+                with st.spinner("Submitting screenplay for batch analysis…"):
+                    batch_id = submit_batch(build_prefix_messages(screenplay_text), INSTRUCTIONS)
+                with batch_store["lock"]:
+                    batch_store["pending"][screenplay_sha] = {"batch_id": batch_id, "sessions": {session_id}}
+            else:
+                try:
+                    analysis_text = screenplay_text
+                    if len(screenplay_text) >= COMPRESS_MIN_CHARS:
+                        with st.spinner("Condensing long screenplay…"):
+                            analysis_text = get_condensed_screenplay(screenplay_sha, screenplay_text)
+
+                    if stream_sections:
+                        live = st.empty()
+                        with live.container():
+                            placeholders = {}
+                            for section in INSTRUCTIONS:
+                                st.write(f"**{section}:**")
+                                placeholders[section] = st.empty()
+                        try:
+                            all_results = stream_all_analyses(analysis_text, placeholders)
+                        finally:
+                            live.empty()  # replaced by the cleaned report, or dropped if cut off
+                    else:
+                        with st.spinner("Analyzing screenplay…"):
+                            if analysis_mode == COMBINED_MODE:
+                                all_results = get_all_analyses_structured(analysis_text)
+                            else:
+                                all_results = get_all_analyses_single(analysis_text)
+                except ReportError as error:
+                    st.error(str(error))
+
+    # Poll a pending batch job this session is waiting on across reruns until it finishes
+    screenplay_sha = st.session_state["screenplay_sha"]
+    pending = batch_store["pending"].get(screenplay_sha)
+    if pending is not None and session_id in pending["sessions"]:
+        status, batch_results, failed = check_batch(pending["batch_id"], list(INSTRUCTIONS))
+        if status in ("completed", "failed", "expired", "cancelling", "cancelled"):
+            # The job is dropped once every waiting session has seen its outcome
+            with batch_store["lock"]:
+                pending["sessions"].discard(session_id)
+                if not pending["sessions"]:
+                    batch_store["pending"].pop(screenplay_sha, None)
+        if status == "completed":
+            if failed:
+                # Partial reports are shown but not kept, so the next run retries them
+                st.warning("Some sections could not be analysed: " + "; ".join(
+                    f"{section} ({message})" for section, message in failed.items()
+                ))
+            else:
+                batch_store["reports"][screenplay_sha] = batch_results
+            all_results = batch_results
+        elif status in ("failed", "expired", "cancelling", "cancelled"):
+            st.error(f"Batch analysis {status}. Please try again.")
+        else:
+            st.info(f"Batch analysis in progress ({status})… this page refreshes automatically.")
+            time.sleep(BATCH_POLL_SECONDS)
+            st.rerun()
+
+    if all_results:
+        # Clean each section once; the same text feeds the page and the PDF
+        cleaned = {section: clean_markdown(content) for section, content in all_results.items()}
+
+        # Display each section in bold, then the cleaned text
+        st.write("**Analysis Results**")
+        st.write("")  # add a blank line
+
+        for section, content in cleaned.items():
+            st.write(f"**{section}:**")
+            st.write(content)
+            st.write("")  # blank line between sections
+
+        # PDF download button
+        pdf_file = create_pdf_report(cleaned)
+        st.success("Analysis complete!")
+        st.download_button(
+            label="Download Analysis Report as PDF",
+            data=pdf_file,
+            file_name=f"{movie_name}-report.pdf",
+            mime="application/pdf"
+        )
 else:
+    close_session_document()
+    if "screenplay_sha" in st.session_state:
+        release_batch(st.session_state["screenplay_sha"], st.session_state["session_id"])
     st.info("Please upload a PDF screenplay to begin analysis.")